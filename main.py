@@ -1,8 +1,114 @@
 import csv
 import re
 import os
+import sys
+import logging
 from io import StringIO
-from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Set once _configure_logging has installed the script's stdout handler
+_logging_configured = False
+
+# Below this much total input, convert files on threads rather than paying
+# process start-up cost
+PROCESS_POOL_MIN_BYTES = 1 << 20
+
+# Buffer size for CSV output files, so csv.writer rows are flushed to disk
+# in large blocks
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Number of distinct measurement+tags prefixes to keep parsed results for
+SERIES_KEY_CACHE_SIZE = 100_000
+
+# Number of distinct tag/field schemas to keep granular CSV headers for
+SCHEMA_CACHE_SIZE = 128
+
+# Whole-line grammar, compiled once at import time:
+#   measurement   - run of non-comma/non-space characters or escape pairs
+#   ,tags         - optional; everything up to the first unescaped space
+#   ' ' fields    - everything up to the optional trailing timestamp
+#   timestamp     - optional run of digits at the end of the line
+# Escape-aware runs are written as "plain* (escape plain*)*" so the regex
+# engine scans each unescaped stretch with a single character-class loop.
+_LINE_RE = re.compile(
+    r'(?P<measurement>[^,\\ ]*(?:\\.[^,\\ ]*)*)'
+    r'(?:,(?P<tags>[^ \\]*(?:\\.[^ \\]*)*))?'
+    r' (?P<fields>.*?)'
+    r'(?:\s+(?P<timestamp>\d+))?'
+)
+
+# One comma-separated key=value pair per match. Pairs that have no
+# unescaped '=' (or an empty value) land in the 'invalid' group instead.
+_KEY_VALUE_RE = re.compile(
+    r'(?:(?P<key>[^=,\\]*(?:\\.[^=,\\]*)*)=(?P<value>(?=[^,])[^,\\]*(?:\\.?[^,\\]*)*)'
+    r'|(?P<invalid>(?=[^,])[^,\\]*(?:\\.?[^,\\]*)*))'
+    r'(?:,|$)'
+)
+
+
+def _unescape(text):
+    """Undoes \\, \\= and \\  escapes in a tag or field key or value."""
+    if '\\' not in text:
+        return text
+    return text.replace('\\,', ',').replace('\\=', '=').replace('\\ ', ' ')
+
+
+def parse_key_values(text):
+    """
+    Parses comma-separated key=value pairs, handling basic escapes.
+
+    Args:
+        text (str): The tag or field section of a line.
+
+    Returns:
+        dict: Unescaped keys mapped to unescaped values.
+    """
+    pairs, invalid_parts = _split_key_values(text)
+    _warn_invalid_pairs(invalid_parts, text)
+    return pairs
+
+
+def _split_key_values(text):
+    """
+    Does the work of parse_key_values without logging.
+
+    Returns:
+        tuple: (pairs dict, list of parts that are not valid key=value pairs).
+    """
+    pairs = {}
+    invalid_parts = []
+    if '\\' not in text:
+        # Nothing is escaped, so plain splits find the same pairs
+        for part in text.split(','):
+            if not part: continue
+            key, _, value = part.partition('=')
+            if not value:
+                invalid_parts.append(part)
+                continue
+            pairs[key] = value
+        return pairs, invalid_parts
+
+    for match in _KEY_VALUE_RE.finditer(text):
+        key, value, invalid = match.group('key', 'value', 'invalid')
+        if invalid is not None:
+            invalid_parts.append(invalid)
+            continue
+        key = _unescape(key)
+        value = _unescape(value)
+        # Further potential value processing (e.g., removing quotes if used)
+        # For simplicity, we take the value as is after basic unescaping.
+        pairs[key] = value
+    return pairs, invalid_parts
+
+
+def _warn_invalid_pairs(invalid_parts, text):
+    """Logs a warning for each unparseable key=value part of text."""
+    for part in invalid_parts:
+        logger.warning("Warning: Could not parse key-value pair: %s in %s", part, text)
+
 
 def parse_line_protocol(line):
     """
@@ -23,104 +129,52 @@ def parse_line_protocol(line):
     if not line or line.startswith('#'):
         return None
 
-    # Regex breakdown:
-    # ([^,\s]+)                     # Measurement (cannot contain comma or space)
-    # ((?:,[^=\s]+=[^,\s]+)*)       # Optional Tags (comma-separated key=value pairs)
-    # \s+                           # Space separator
-    # ([^=\s]+=[^\s]+(?:,[^=\s]+=[^\s]+)*) # Fields (key=value pairs, at least one required)
-    # (?:\s+(\d+))?                 # Optional Timestamp
-    # Simplified regex - assumes values don't contain spaces or commas unless escaped
-    # A more robust parser would handle complex quoting and escaping properly.
-    # This one focuses on basic splitting.
-
-    measurement_part = ''
-    tags_part = ''
-    fields_part = ''
-    timestamp_part = ''
-
-    # Find the first unescaped space to separate measurement+tags from fields+timestamp
-    space_idx = -1
-    escaped = False
-    for i, char in enumerate(line):
-        if char == '\\' and not escaped:
-            escaped = True
-        elif char == ' ' and not escaped:
-            space_idx = i
-            break
-        else:
-            escaped = False
-
-    if space_idx == -1:
-        print(f"Warning: Skipping malformed line (no space separator): {line}")
+    match = _LINE_RE.fullmatch(line)
+    if not match:
+        logger.warning("Warning: Skipping malformed line (no space separator): %s", line)
         return None
 
-    measurement_and_tags = line[:space_idx]
-    fields_and_timestamp = line[space_idx+1:]
-
-    # Split measurement and tags
-    first_comma_idx = -1
-    escaped = False
-    for i, char in enumerate(measurement_and_tags):
-         if char == '\\' and not escaped:
-            escaped = True
-         elif char == ',' and not escaped:
-            first_comma_idx = i
-            break
-         else:
-            escaped = False
-
-    if first_comma_idx != -1:
-        measurement_part = measurement_and_tags[:first_comma_idx]
-        tags_part = measurement_and_tags[first_comma_idx+1:]
-    else:
-        measurement_part = measurement_and_tags
-        tags_part = '' # No tags
-
-    # Find the last space to separate fields and timestamp
-    last_space_idx = -1
-    match_timestamp = re.search(r'\s+(\d+)$', fields_and_timestamp)
-    if match_timestamp:
-        timestamp_part = match_timestamp.group(1)
-        fields_part = fields_and_timestamp[:match_timestamp.start()]
-    else:
-        fields_part = fields_and_timestamp # No timestamp
-        timestamp_part = ''
-
-    # --- Helper to parse key-value pairs (handling basic escapes) ---
-    def parse_key_values(text):
-        pairs = {}
-        # Simple split by comma first, then refine if needed (basic approach)
-        # A full parser would handle escapes during splitting.
-        for part in re.split(r'(?<!\\),', text): # Split on non-escaped commas
-            if not part: continue
-            # Split on the first non-escaped equals sign
-            match = re.match(r'([^=\\]*(?:\\.[^=\\]*)*)=(.+)', part)
-            if match:
-                key = match.group(1).replace('\\,', ',').replace('\\=', '=').replace('\\ ', ' ')
-                value = match.group(2).replace('\\,', ',').replace('\\=', '=').replace('\\ ', ' ')
-                # Further potential value processing (e.g., removing quotes if used)
-                # For simplicity, we take the value as is after basic unescaping.
-                pairs[key] = value
-            else:
-                 print(f"Warning: Could not parse key-value pair: {part} in {text}")
-        return pairs
+    measurement_part, tags_part, fields_part, timestamp_part = match.group(
+        'measurement', 'tags', 'fields', 'timestamp')
 
-    # Parse tags and fields
-    tags = parse_key_values(tags_part) if tags_part else {}
+    # Parse tags and fields. The cached series key is immutable, so every
+    # line gets its own tags dict and its own tag warnings.
+    measurement, tag_items, invalid_tags = _parse_series_key(measurement_part, tags_part)
+    _warn_invalid_pairs(invalid_tags, tags_part)
+    tags = dict(tag_items)
     fields = parse_key_values(fields_part)
 
-    if not measurement_part or not fields:
-        print(f"Warning: Skipping malformed line (missing measurement or fields): {line}")
+    if not measurement or not fields:
+        logger.warning("Warning: Skipping malformed line (missing measurement or fields): %s", line)
         return None
 
     return {
-        "measurement": measurement_part.replace('\\,', ',').replace('\\ ', ' '),
+        "measurement": measurement,
         "tags": tags,
         "fields": fields,
-        "timestamp": timestamp_part
+        "timestamp": timestamp_part or ''
     }
 
 
+@lru_cache(maxsize=SERIES_KEY_CACHE_SIZE)
+def _parse_series_key(measurement_part, tags_part):
+    """
+    Unescapes the measurement and parses the tags of a line. Cached, since
+    the same measurement+tags prefix typically repeats on many lines.
+
+    Returns:
+        tuple: (measurement, tuple of (key, value) tag items, tuple of
+               unparseable tag parts). Nothing is logged here, so callers
+               report the unparseable parts on every line.
+    """
+    if tags_part:
+        tags, invalid_tags = _split_key_values(tags_part)
+    else:
+        tags, invalid_tags = {}, []
+    measurement = measurement_part.replace('\\,', ',').replace('\\ ', ' ')
+    return measurement, tuple(tags.items()), tuple(invalid_tags)
+
+
 def convert_lp_content_to_granular_csv(line_protocol_data):
     """
     Converts line protocol data string to a CSV string with individual
@@ -132,123 +186,272 @@ def convert_lp_content_to_granular_csv(line_protocol_data):
     Returns:
         String containing CSV data, or None if no valid data.
     """
-    parsed_lines = []
-    all_tag_keys = set()
-    all_field_keys = set()
+    return convert_lp_lines_to_granular_csv(line_protocol_data.split('\n'))
+
+
+def convert_lp_lines_to_granular_csv(lines):
+    """
+    Converts line protocol lines to a CSV string with individual
+    tag and field columns.
 
-    # Pass 1: Parse lines and collect all keys
-    lines = line_protocol_data.strip().split('\n')
-    if not lines or not lines[0]:
+    Args:
+        lines: Iterable of line protocol lines, e.g. an open text file.
+               Lines are consumed lazily, so the raw input is never held
+               in memory as a whole.
+
+    Returns:
+        String containing CSV data, or None if no valid data.
+    """
+    table = _build_granular_table(lines)
+    if table is None:
         return None
 
-    for line in lines:
-        parsed = parse_line_protocol(line)
-        if parsed:
-            parsed_lines.append(parsed)
-            all_tag_keys.update(parsed["tags"].keys())
-            all_field_keys.update(parsed["fields"].keys())
+    output = StringIO()
+    _write_granular_csv(output, *table)
+    return output.getvalue()
 
-    if not parsed_lines:
+
+def _build_granular_table(lines):
+    """
+    Parses line protocol lines into a granular CSV header and its rows.
+
+    Values are accumulated column by column in a single pass; rows are
+    produced at the end by zipping the columns together.
+
+    Returns:
+        tuple: (header, rows) where rows lazily yields one tuple per parsed
+               line, or None if there is no valid data.
+    """
+    measurements = []
+    timestamps = []
+    tag_columns = {}
+    field_columns = {}
+
+    for parsed in map(parse_line_protocol, lines):
+        if not parsed:
+            continue
+        row_index = len(measurements)
+        measurements.append(parsed["measurement"])
+        timestamps.append(parsed["timestamp"])
+        _append_to_columns(tag_columns, parsed["tags"], row_index)
+        _append_to_columns(field_columns, parsed["fields"], row_index)
+
+    row_count = len(measurements)
+    if not row_count:
         return None # No valid lines found
 
-    # Determine header order
-    sorted_tag_keys = sorted(list(all_tag_keys))
-    sorted_field_keys = sorted(list(all_field_keys))
-    header = ['measurement'] + sorted_tag_keys + sorted_field_keys + ['timestamp']
+    # Determine header order, reusing the plan of any earlier file with the
+    # same schema
+    header, sorted_tag_keys, sorted_field_keys = _granular_header(
+        frozenset(tag_columns), frozenset(field_columns))
+
+    # Each header name maps to one column, filled in the order measurement,
+    # tags, fields, timestamp with later sections winning. A name repeated in
+    # the header (a key used as both tag and field, or a key called
+    # 'measurement' or 'timestamp') therefore shows the same values in every
+    # column it heads.
+    columns_by_name = {'measurement': measurements}
+    for key in sorted_tag_keys:
+        columns_by_name[key] = _pad_column(tag_columns[key], row_count)
+    for key in sorted_field_keys:
+        columns_by_name[key] = _pad_column(field_columns[key], row_count)
+    columns_by_name['timestamp'] = timestamps
+    columns = [columns_by_name[name] for name in header]
+
+    return header, zip(*columns)
+
+
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _granular_header(tag_keys, field_keys):
+    """
+    Builds the granular CSV header for a schema, given frozensets of its
+    tag and field keys. Cached, since files from the same source nearly
+    always share a schema.
+
+    Returns:
+        tuple: (header, sorted tag keys, sorted field keys), all tuples.
+    """
+    sorted_tag_keys = tuple(sorted(tag_keys))
+    sorted_field_keys = tuple(sorted(field_keys))
+    header = ('measurement',) + sorted_tag_keys + sorted_field_keys + ('timestamp',)
+    return header, sorted_tag_keys, sorted_field_keys
 
-    # Pass 2: Generate CSV output
-    output = StringIO()
+
+def _append_to_columns(columns, pairs, row_index):
+    """
+    Appends each value in pairs to its key's column in columns, first
+    filling rows where the key was absent with ''.
+    """
+    for key, value in pairs.items():
+        column = columns.get(key)
+        if column is None:
+            columns[key] = column = [''] * row_index
+        elif len(column) < row_index:
+            column.extend([''] * (row_index - len(column)))
+        column.append(value)
+
+
+def _pad_column(column, row_count):
+    """Fills a column with '' for trailing rows where its key was absent."""
+    if len(column) < row_count:
+        column.extend([''] * (row_count - len(column)))
+    return column
+
+
+def _write_granular_csv(out_file, header, rows):
+    """
+    Writes a header and rows from _build_granular_table to an open text
+    file (opened with newline='') or other writable text stream.
+    """
     # Use dialect='unix' to prevent extra blank rows in CSV on non-Windows
     # Use quoting=csv.QUOTE_MINIMAL or QUOTE_NONNUMERIC if values might contain commas
-    csv_writer = csv.writer(output, dialect='unix', quoting=csv.QUOTE_MINIMAL)
+    csv_writer = csv.writer(out_file, dialect='unix', quoting=csv.QUOTE_MINIMAL)
     csv_writer.writerow(header)
+    # Hand all rows to the writer in one call so the C writer drives the loop
+    csv_writer.writerows(rows)
 
-    for data in parsed_lines:
-        row = OrderedDict() # Use OrderedDict to maintain key order insertion
-        row['measurement'] = data['measurement']
-        # Add tags - use get() with default '' if tag not present in this line
-        for key in sorted_tag_keys:
-            row[key] = data['tags'].get(key, '')
-        # Add fields - use get() with default '' if field not present in this line
-        for key in sorted_field_keys:
-            row[key] = data['fields'].get(key, '')
-        row['timestamp'] = data['timestamp']
 
-        # Write the values in the order defined by the header
-        csv_writer.writerow([row.get(col_name, '') for col_name in header])
+def _configure_logging():
+    """
+    Sends INFO and above to stdout as plain messages. Only called when
+    running as a script; library callers keep their own logging setup.
+    """
+    global _logging_configured
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    _logging_configured = True
 
 
-    return output.getvalue()
+def _init_worker(level, configure_logging):
+    """
+    Mirrors the parent's logging in a process-pool worker, which does not
+    inherit handlers or levels on spawn-based platforms (and logs there
+    under '__mp_main__' rather than '__main__' when run as a script).
+    """
+    if configure_logging:
+        _configure_logging()
+    logger.setLevel(level)
+
+
+def _convert_one(filename, input_filepath, output_dir):
+    """
+    Converts a single line protocol file at input_filepath to a granular
+    CSV file in output_dir. Runs inside a worker of
+    convert_files_in_directory.
+
+    Returns:
+        tuple: (filename, True if a CSV file was written).
+    """
+    logger.info("Processing file: %s", filename)
+    try:
+        # Stream lines straight from the file instead of reading it whole
+        with open(input_filepath, 'r', encoding='utf-8') as infile:
+            table = _build_granular_table(infile)
+
+        if table is not None:
+            base_filename, _ = os.path.splitext(filename)
+            output_filename = f"{base_filename}.csv"
+            output_filepath = os.path.join(output_dir, output_filename)
+
+            # Stream rows straight into the CSV file, ensuring newline='' is used
+            with open(output_filepath, 'w', encoding='utf-8', newline='',
+                      buffering=OUTPUT_BUFFER_SIZE) as outfile:
+                _write_granular_csv(outfile, *table)
+            logger.info("Successfully converted '%s' to '%s'", filename, output_filename)
+            return filename, True
+
+        logger.info("Skipping '%s': No valid line protocol data found or parsed.", filename)
+    except Exception as e:
+        logger.error("Error processing file %s: %s", filename, e)
+    return filename, False
 
 
 def convert_files_in_directory(input_dir, output_dir):
     """
     Reads line protocol files from input_dir, converts them to granular CSV,
     and saves them to output_dir.
+
+    Files are converted in parallel. Process workers are used when there is
+    enough input to outweigh their start-up cost and more than one of them
+    would run, threads otherwise.
     """
     os.makedirs(output_dir, exist_ok=True)
-    print(f"Ensured output directory exists: {os.path.abspath(output_dir)}")
+    logger.info("Ensured output directory exists: %s", os.path.abspath(output_dir))
 
     try:
-        entries = os.listdir(input_dir)
+        # scandir entries carry the file type, so checking an entry and
+        # sizing it (is_file() + stat()) costs one stat per file instead of
+        # the two from isfile() + getsize()
+        with os.scandir(input_dir) as it:
+            entries = list(it)
     except FileNotFoundError:
-        print(f"Error: Input directory not found: {input_dir}")
+        logger.error("Error: Input directory not found: %s", input_dir)
         return
     except Exception as e:
-        print(f"Error listing files in {input_dir}: {e}")
+        logger.error("Error listing files in %s: %s", input_dir, e)
         return
 
-    print(f"Found {len(entries)} entries in {input_dir}. Processing files...")
+    logger.info("Found %d entries in %s. Processing files...", len(entries), input_dir)
 
     processed_count = 0
     skipped_count = 0
 
-    for filename in entries:
-        input_filepath = os.path.join(input_dir, filename)
-
-        if os.path.isfile(input_filepath):
-            print(f"Processing file: {filename}")
+    files = []
+    total_bytes = 0
+    for entry in entries:
+        try:
+            if not entry.is_file():
+                logger.info("Skipping non-file entry: %s", entry.name)
+                continue
+            total_bytes += entry.stat().st_size
+        except OSError as e:
+            # e.g. removed or made unreadable since the directory was listed
+            logger.error("Error processing file %s: %s", entry.name, e)
+            skipped_count += 1
+            continue
+        files.append(entry)
+
+    # A single process worker would add start-up and IPC cost without any
+    # parallelism, so that case also runs on threads
+    process_workers = min(len(files), os.cpu_count() or 1)
+    if total_bytes >= PROCESS_POOL_MIN_BYTES and process_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=process_workers,
+                                       initializer=_init_worker,
+                                       initargs=(logger.getEffectiveLevel(), _logging_configured))
+    else:
+        executor = ThreadPoolExecutor()
+
+    with executor:
+        futures = {
+            executor.submit(_convert_one, entry.name, entry.path, output_dir): entry.name
+            for entry in files
+        }
+        for future in as_completed(futures):
             try:
-                with open(input_filepath, 'r', encoding='utf-8') as infile:
-                    line_protocol_content = infile.read()
-
-                # Use the new conversion function
-                csv_content = convert_lp_content_to_granular_csv(line_protocol_content)
-
-                if csv_content:
-                    base_filename, _ = os.path.splitext(filename)
-                    output_filename = f"{base_filename}.csv"
-                    output_filepath = os.path.join(output_dir, output_filename)
-
-                    # Write CSV, ensuring newline='' is used
-                    with open(output_filepath, 'w', encoding='utf-8', newline='') as outfile:
-                        outfile.write(csv_content)
-                    print(f"Successfully converted '{filename}' to '{output_filename}'")
-                    processed_count += 1
-                else:
-                    print(f"Skipping '{filename}': No valid line protocol data found or parsed.")
-                    skipped_count += 1
-
+                _, ok = future.result()
             except Exception as e:
-                print(f"Error processing file {filename}: {e}")
+                logger.error("Error processing file %s: %s", futures[future], e)
+                ok = False
+            if ok:
+                processed_count += 1
+            else:
                 skipped_count += 1
-        else:
-            print(f"Skipping non-file entry: {filename}")
 
-    print("\n--- Conversion Summary ---")
-    print(f"Total files processed: {processed_count}")
-    print(f"Total files/entries skipped: {skipped_count}")
-    print("------------------------")
+    logger.info("\n--- Conversion Summary ---")
+    logger.info("Total files processed: %d", processed_count)
+    logger.info("Total files/entries skipped: %d", skipped_count)
+    logger.info("------------------------")
 
 # --- Script Execution ---
 if __name__ == "__main__":
+    _configure_logging()
+
     INPUT_DIRECTORY = './input'
     OUTPUT_DIRECTORY = './output'
 
-    print("Starting Line Protocol to Granular CSV conversion...")
-    print(f"Input directory: {os.path.abspath(INPUT_DIRECTORY)}")
-    print(f"Output directory: {os.path.abspath(OUTPUT_DIRECTORY)}")
+    logger.info("Starting Line Protocol to Granular CSV conversion...")
+    logger.info("Input directory: %s", os.path.abspath(INPUT_DIRECTORY))
+    logger.info("Output directory: %s", os.path.abspath(OUTPUT_DIRECTORY))
 
     convert_files_in_directory(INPUT_DIRECTORY, OUTPUT_DIRECTORY)
 
-    print("Conversion process finished.")
+    logger.info("Conversion process finished.")